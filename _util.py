@@ -20,89 +20,267 @@
 import sys
 import os
 import re
+import json
+import shutil
+import functools
 import subprocess
+import threading
 from datetime import datetime, timedelta
-from exiftool import ExifToolHelper
-from typing import Any, Container, Iterable, List, Dict, Optional, Union
+from typing import Any, Container, Iterable, List, Dict, Optional, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    from exiftool import ExifToolHelper
 
 #import logging
 #logging.basicConfig(level=logging.DEBUG)
 
-EXIF_KEY_HINTS = ['CreateDate', 'ModifyDate', 'DateTimeOriginal', 'OffsetTime', 'Aperture', 'Gain', 'Exposure', 'WhiteBalance', 'ISO', 'ImageStabilization', 'FNumber', 'Shutter', 'FrameRate', 'Rotation', 'GPS', 'Make', 'Model', 'MajorBrand', 'MinorVersion', 'CompatibleBrands', 'FileFunctionFlags', 'UserComment']
+# Compiled once. Date separator can be '-' (mediainfo, option) or ':' (EXIF).
+_DT_RE = re.compile(r'^(?P<year>\d{4})[-:](?P<month>\d\d)[-:](?P<day>\d\d)(?: (?P<hour>\d\d):(?P<minute>\d\d)(?::(?P<second>\d\d))?)?')
+_EXIF_DATE_SEP = str.maketrans(':', '-')
+_OFFSET_RE = re.compile(r'(?P<sign>[+-]?)(?P<hour>\d?\d):(?P<minute>\d\d)(?::(?P<second>\d\d))?')
+
+EXIF_KEY_HINTS = ('CreateDate', 'ModifyDate', 'DateTimeOriginal', 'OffsetTime', 'Aperture', 'Gain', 'Exposure', 'WhiteBalance', 'ISO', 'ImageStabilization', 'FNumber', 'Shutter', 'FrameRate', 'Rotation', 'GPS', 'Make', 'Model', 'MajorBrand', 'MinorVersion', 'CompatibleBrands', 'FileFunctionFlags', 'UserComment')
+_EXIF_HINT_RE = re.compile('|'.join(map(re.escape, EXIF_KEY_HINTS)))
+
+
+@functools.lru_cache(maxsize=None)
+def which(cmd: str) -> str:
+    '''
+    Full path to cmd found in PATH, or cmd as is if not found.
+    Looked up once without spawning a process.
+    '''
+    return shutil.which(cmd) or cmd
+
+
+@functools.lru_cache(maxsize=None)
+def _pymediainfo() -> Any:
+    '''
+    MediaInfo class of pymediainfo if it and libmediainfo are available, otherwise None.
+    Optional. It runs libmediainfo in process instead of spawning mediainfo.
+    '''
+    try:
+        from pymediainfo import MediaInfo
+    except ImportError:
+        return None
+    return MediaInfo if MediaInfo.can_parse() else None
+
+
+def has_mediainfo() -> bool:
+    '''
+    True if pymediainfo or mediainfo CLI is available.
+    '''
+    return _pymediainfo() is not None or which('mediainfo') != 'mediainfo' # Name as is if not found
+
+
+def _run_mediainfo(path: str, output: str) -> str:
+    MediaInfo = _pymediainfo()
+    if MediaInfo is not None:
+        return MediaInfo.parse(path, output=output)
+    p = subprocess.run([which('mediainfo'), f'--Output={output}', path], check=True, text=True, stdout=subprocess.PIPE)
+    return p.stdout
+
+
+def _stat_key(path: str) -> tuple[int, int]:
+    # Cache key with path. A file modified (or replaced) since is probed again.
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
 
 
 def get_mediainfo(path: str, field: str) -> str:
     '''
     Run mediainfo to get information of the movie in path.
+    Results are cached while the file is not modified.
+    '''
+    return _get_mediainfo(path, field, *_stat_key(path))
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_mediainfo(path: str, field: str, mtime_ns: int, size: int) -> str:
+    return _run_mediainfo(path, field).partition('\n')[0]
+
+
+def _get_mediainfo_tracks(path: str) -> List[Dict[str, Any]]:
+    return _get_mediainfo_tracks_cached(path, *_stat_key(path))
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_mediainfo_tracks_cached(path: str, mtime_ns: int, size: int) -> List[Dict[str, Any]]:
+    media = json.loads(_run_mediainfo(path, 'JSON')).get('media') or {}
+    return media.get('track', [])
+
+
+def get_mediainfo_many(path: str, fields: List[str]) -> Dict[str, str]:
     '''
-    p = subprocess.run(['mediainfo', f'--Output={field}', path], check=True, text=True, stdout=subprocess.PIPE)
-    return p.stdout.split('\n')[0]
+    Run mediainfo once to get several fields of the movie in path.
+    Fields are given as for get_mediainfo(), e.g. 'Video;%Height%'.
+    Returns a dict keyed by the fields. Missing fields are ''.
+    '''
+    tracks = _get_mediainfo_tracks(path)
+    result = {}
+    for field in fields:
+        kind, name = field.split(';', 1)
+        name = name.strip('%')
+        vals = [track.get(name, '') for track in tracks if track.get('@type') == kind]
+        result[field] = vals[0] if len(vals) > 0 else ''
+    return result
+
+
+def new_exiftool(**kwargs: Any) -> 'ExifToolHelper':
+    '''
+    Create ExifToolHelper. pyexiftool is imported here, not to slow down
+    start up of the CLIs when no exif is needed.
+    '''
+    from exiftool import ExifToolHelper
+    return ExifToolHelper(**kwargs)
+
+
+class ExifToolPerThread:
+    '''
+    Give each thread its own ExifToolHelper (stay_open), so that parallel
+    workers never share an exiftool pipe. All of them are terminated on exit.
+    exiftool starts at the first command, so no Perl is spawned when no exif is needed.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._etools: List['ExifToolHelper'] = []
+
+    def get(self) -> Optional['ExifToolHelper']:
+        '''
+        ExifToolHelper of this thread. None if exiftool or pyexiftool is not installed,
+        exif functions then fail only when they are really called.
+        '''
+        etool = getattr(self._local, 'etool', None)
+        if etool is None:
+            try:
+                etool = new_exiftool(auto_start=True)
+            except (FileNotFoundError, ImportError):
+                return None
+            self._local.etool = etool
+            with self._lock:
+                self._etools.append(etool)
+        return etool
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *exc_info):
+        for etool in self._etools:
+            if etool.running:
+                etool.terminate()
 
-def get_exifdata(path: str, field: str) -> str|None:
-    with ExifToolHelper() as etool:
-        data = etool.get_tags(path, field)
-        tags = [val for key,val in data[0].items() if field in key]
-        if len(tags) > 0:
-            return tags[0]
+
+def get_exifdata(path: str, field: str, etool: Optional['ExifToolHelper'] = None) -> str|None:
+    '''
+    Run exiftool to get a field of the file in path.
+    Give etool to reuse a running exiftool (stay_open) among many files.
+    '''
+    if etool is None:
+        with new_exiftool() as etool:
+            return get_exifdata(path, field, etool)
+    data = etool.get_tags(path, field)
+    tags = [val for key,val in data[0].items() if field in key]
+    if len(tags) > 0:
+        return tags[0]
     return None
 
 
-def set_exifdata(path: str, field: str, val: str):
-    with ExifToolHelper() as etool:
-        etool.set_tags(path, {field: val})
+def set_exifdata(path: str, field: str, val: str, etool: Optional['ExifToolHelper'] = None):
+    if etool is None:
+        with new_exiftool() as etool:
+            return set_exifdata(path, field, val, etool)
+    etool.set_tags(path, {field: val})
 
 
-def copy_exifdata(pathfrom: str, pathto:str):
-    with ExifToolHelper() as etool:
-        data = etool.get_metadata(pathfrom)
-        datatocopy = {key:val for key, val in data[0].items() for keypart in EXIF_KEY_HINTS if keypart in key}
-        etool.set_tags(pathto, datatocopy)
+def copy_exifdata(pathfrom: str, pathto:str, etool: Optional['ExifToolHelper'] = None, comment: Optional[str] = None):
+    '''
+    Copy EXIF fields in EXIF_KEY_HINTS from pathfrom to pathto.
+    If comment is given, it is prepended to UserComment in the same write, as append_exifcomment().
+    '''
+    if etool is None:
+        with new_exiftool() as etool:
+            return copy_exifdata(pathfrom, pathto, etool, comment)
+    data = etool.get_metadata(pathfrom)
+    datatocopy = {key:val for key, val in data[0].items() if _EXIF_HINT_RE.search(key)}
+    if comment is not None:
+        comments = [val for key, val in datatocopy.items() if 'UserComment' in key]
+        datatocopy['UserComment'] = f'{comment}\n{comments[0] if len(comments) > 0 else ""}'
+    etool.set_tags(pathto, datatocopy)
 
 
-def append_exifcomment(pathto: str, text:str):
-    comment = get_exifdata(pathto, 'UserComment')
+def append_exifcomment(pathto: str, text:str, etool: Optional['ExifToolHelper'] = None):
+    if etool is None:
+        with new_exiftool() as etool:
+            return append_exifcomment(pathto, text, etool)
+    comment = get_exifdata(pathto, 'UserComment', etool)
     if comment is None:
         comment = ''
-    set_exifdata(pathto, 'UserComment', f'{text}\n{comment}')
+    set_exifdata(pathto, 'UserComment', f'{text}\n{comment}', etool)
 
 
-def get_datetime_fromstr(datetime_str: str, datetime_pattern: Optional[str] = None) -> datetime|None:
+@functools.lru_cache(maxsize=1024)
+def get_datetime_fromstr(datetime_str: str, datetime_pattern: Optional[re.Pattern|str] = None) -> datetime|None:
+    '''
+    Parse date/time in datetime_str, like "yyyy-mm-dd[ HH:MM[:SS]]".
+    datetime_pattern needs named groups year, month, day and optionally hour, minute, second.
+    Cached, as the same --datetime is parsed for every file. datetime is immutable.
+    '''
+    if not datetime_str:
+        return None
     if datetime_pattern is None:
-        datetime_pattern = r'^(\d\d\d\d)[-|:](\d\d)[-|:](\d\d)( (\d\d):(\d\d)(:(\d\d))?)?'
-    m = re.match(datetime_pattern, datetime_str)
+        # Fast path by the C parser when time is present, "yyyy-mm-dd HH:MM" or "yyyy-mm-dd HH:MM:SS[...]".
+        # Date only goes to the regex to default to 12:00.
+        # Like the regex, a zone after time is ignored. Such as "HH:MM+09" goes to the regex.
+        if ((len(datetime_str) == 16 or len(datetime_str) >= 19)
+                and datetime_str[10] == ' ' and datetime_str[13] == ':'):
+            try:
+                dt = datetime.fromisoformat(datetime_str[:10].translate(_EXIF_DATE_SEP) + datetime_str[10:19])
+                if dt.tzinfo is None:
+                    return dt
+            except ValueError:
+                pass
+        datetime_pattern = _DT_RE
+    elif isinstance(datetime_pattern, str):
+        datetime_pattern = re.compile(datetime_pattern)
+    m = datetime_pattern.match(datetime_str)
     if m is None:
         return None
-    year_s = m.group(1)
-    month_s = m.group(2)
-    day_s = m.group(3)
-    hh_s = m.group(5)
-    mm_s = m.group(6)
-    ss_s = m.group(8)
+    hh_s = m.group('hour')
+    mm_s = m.group('minute')
+    ss_s = m.group('second')
     if hh_s is None:
         hh_s = '12'
     if mm_s is None:
         mm_s = '00'
     if ss_s is None:
         ss_s = '00'
-    return datetime(int(year_s), int(month_s), int(day_s), int(hh_s), int(mm_s), int(ss_s))
+    return datetime(int(m.group('year')), int(m.group('month')), int(m.group('day')), int(hh_s), int(mm_s), int(ss_s))
 
 
-def get_datetime_fromfile(path: str, offset: Optional[str] = None) -> datetime|None:
-    datetime_str = get_mediainfo(path, 'General;%Recorded_Date%')
+def get_datetime_fromfile(path: str,
+                          offset: Optional[str] = None,
+                          etool: Optional['ExifToolHelper'] = None,
+                          recorded_date: Optional[str] = None) -> datetime|None:
+    '''
+    Get recording date/time of the movie in path.
+    Give recorded_date if 'General;%Recorded_Date%' is already obtained from mediainfo.
+    '''
+    datetime_str = recorded_date
+    if datetime_str is None:
+        # Shares the cached probe with get_mediainfo_many() callers.
+        datetime_str = get_mediainfo_many(path, ['General;%Recorded_Date%'])['General;%Recorded_Date%']
     dt = get_datetime_fromstr(datetime_str)
     if dt is None:
-        datetime_str = get_exifdata(path, 'DateTimeOriginal')
+        datetime_str = get_exifdata(path, 'DateTimeOriginal', etool)
         dt = get_datetime_fromstr(datetime_str)
         if dt is None:
             return None
     if offset is not None:
-        m = re.fullmatch(r'([+|-]?)(\d?\d):(\d\d)(:(\d\d))?', offset.strip())
+        m = _OFFSET_RE.fullmatch(offset.strip())
         if m is not None:
-            polarity = m.group(1)
-            hh_s = m.group(2)
-            mm_s = m.group(3)
-            ss_s = m.group(5)
+            polarity = m.group('sign')
+            hh_s = m.group('hour')
+            mm_s = m.group('minute')
+            ss_s = m.group('second')
             if ss_s is None:
                 ss_s = '00'
             delta = timedelta(hours = int(hh_s), minutes = int(mm_s), seconds = int(ss_s))
@@ -113,8 +291,23 @@ def get_datetime_fromfile(path: str, offset: Optional[str] = None) -> datetime|N
     return dt
 
 
-fname_format = '{}-{}-{}_{}{}_{}' # replaced by yyyy, mm, dd, HH, MM, SS
-fname_regexp = r'(\d\d\d\d)-(\d\d)-(\d\d)(_(\d\d)(\d\d)(_(\d\d))?)?'
+def get_datetime(path: str,
+                 datetime_opt: Optional[str] = '',
+                 offset: Optional[str] = None,
+                 etool: Optional['ExifToolHelper'] = None,
+                 recorded_date: Optional[str] = None) -> datetime|None:
+    '''
+    Obtain date/time given as datetime_opt, otherwise Recorded Date of the movie in path.
+    '''
+    dt = get_datetime_fromstr(datetime_opt)
+    if dt is None:
+        dt = get_datetime_fromfile(path, offset, etool, recorded_date)
+    return dt
+
+
+fname_format = '%Y-%m-%d_%H%M_%S' # strftime format, yyyy-mm-dd_HHMM_SS
+fname_regexp = r'(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)(?:_(?P<hour>\d\d)(?P<minute>\d\d)(?:_(?P<second>\d\d))?)?'
+_FNAME_RE = re.compile(fname_regexp)
 
 
 def datetime2strs(dt: datetime) -> tuple[str, str, str, str, str, str]:
@@ -122,16 +315,15 @@ def datetime2strs(dt: datetime) -> tuple[str, str, str, str, str, str]:
 
 
 def datetime2fname(dt: datetime) -> str:
-    y0, m0, d0, hh0, mm0, ss0 = datetime2strs(dt)
-    return fname_format.format(y0, m0, d0, hh0, mm0, ss0)
+    return dt.strftime(fname_format)
 
 
-def guess_offset(path: str) -> timedelta|None:
+def guess_offset(path: str, etool: Optional['ExifToolHelper'] = None) -> timedelta|None:
     '''
     Find difference between embedded recording time and filename.
     '''
-    dt_filename = get_datetime_fromstr(os.path.basename(path), fname_regexp)
-    dt_embedded = get_datetime_fromfile(path)
+    dt_filename = get_datetime_fromstr(os.path.basename(path), _FNAME_RE)
+    dt_embedded = get_datetime_fromfile(path, etool=etool)
     if dt_filename is None or dt_embedded is None:
         return None
     else:
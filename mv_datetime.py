@@ -28,36 +28,35 @@ Input movies are assumed to have Recorded Date field found by 'mediainfo'.
 import argparse
 import sys
 import os
+from pathlib import PurePath
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from _util import get_mediainfo, get_datetime_fromstr, get_datetime_fromfile, datetime2fname, guess_offset
-from typing import Any, Container, Iterable, List, Dict, Optional, Union
+from _util import get_datetime_fromstr, get_datetime, datetime2fname, guess_offset, ExifToolPerThread
+from typing import Any, Container, Iterable, List, Dict, Optional, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    from exiftool import ExifToolHelper
 
 
-def get_datetime(path: str,
-                datetime_opt: Optional[str] = '',
-                offset: Optional[str|None] = None) -> datetime:
+def set_filetime(path: str, dt: datetime):
     '''
-    Obtain Recorded Date and return datetime.
-    Internally uses mediainfo
+    Set access and modify time of path to dt, in integer nanoseconds.
     '''
-    
-    dt = get_datetime_fromstr(datetime_opt)
-    if dt is None:
-        dt = get_datetime_fromfile(path, offset)
-    return dt
+    ns = int(dt.timestamp()) * 1_000_000_000 + dt.microsecond * 1000
+    os.utime(path, ns=(ns, ns))
 
 
 def touch_datetime(path: str,
                 datetime_opt: Optional[str] = '',
                 offset: Optional[str|None] = None,
                 simulate: Optional[bool] = False,
+                etool: Optional['ExifToolHelper'] = None,
                 **kwargs: Any):
     '''
     Touch movie file using Recorded Date.
     Internally uses mediainfo
     '''
     
-    dt = get_datetime(path, datetime_opt, offset)
+    dt = get_datetime(path, datetime_opt, offset, etool)
     if dt is None:
         print(f'Fail to get recorded date from {path} and you did not provide datetime as option.', file=sys.stderr)
         return 1
@@ -65,8 +64,7 @@ def touch_datetime(path: str,
         print(f'os.utile {path}   {dt}')
     else:
         # Set modify timestamp
-        cr_time = dt.timestamp()
-        os.utime(path, (cr_time, cr_time))
+        set_filetime(path, dt)
 
 
 def mv_datetime(path: str,
@@ -74,24 +72,20 @@ def mv_datetime(path: str,
                 offset: Optional[str|None] = None,
                 simulate: Optional[bool] = False,
                 yes: Optional[bool] = False,
+                etool: Optional['ExifToolHelper'] = None,
                 **kwargs: Any):
     '''
     Rename a movie file using Recorded Date.
     Internally uses mediainfo
     '''
-    global formatstr
-    
     # General / Recorded date appears like 2005-07-02 09:48:06 in localtime
-    dt = get_datetime(path, datetime_opt, offset)
+    dt = get_datetime(path, datetime_opt, offset, etool)
     if dt is None:
         print(f'Fail to get recorded date from {path} and you did not provide datetime as option.', file=sys.stderr)
         return 1
-    fstem = datetime2fname(dt)
-
     # Rename
-    dirpath = os.path.dirname(path)
-    _, fileext = os.path.splitext(path)
-    to = os.path.join(dirpath, fstem + fileext)
+    p = PurePath(path)
+    to = str(p.with_name(datetime2fname(dt) + p.suffix))
     if simulate:
         print(f'{path}  ==>  {to}')
     else:
@@ -100,13 +94,10 @@ def mv_datetime(path: str,
         else:
             os.rename(path, to)
         # Set modify timestamp
-        cr_time = dt.timestamp()
-        os.utime(to, (cr_time, cr_time))
+        set_filetime(to, dt)
 
     
 def main(argv: Optional[List[str]] = None) -> int:
-    global formatstr
-    
     if sys.version_info < REQUIRED_PYTHON_VERSION:
         print(f'Requires python {REQUIRED_PYTHON_VERSION} or newer.', file=sys.stderr)
         return 1
@@ -121,6 +112,7 @@ def main(argv: Optional[List[str]] = None) -> int:
     parser.add_argument('--touch', action='store_true', default=False, help='Modify file modification time only')
     parser.add_argument('--simulate', action='store_true', default=False, help='Print generated command, no file change')
     parser.add_argument('-y', '--yes', action='store_true', default=False, help='Yes to overwrite.')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=os.cpu_count() or 1, help='Number of files processed in parallel')
     parser.add_argument('infiles', nargs='+', type=str, help='Input movie files')
 
     args = parser.parse_args(args=argv)
@@ -128,16 +120,34 @@ def main(argv: Optional[List[str]] = None) -> int:
     #if args.format is not None:
     #    formatstr = args.format
 
-    for path in args.infiles:
-        args.path = path
-        if args.guess:
-            dif = guess_offset(path)
-            print(f'{dif} : {path}')
-        elif args.touch:
-            touch_datetime(**vars(args))
-        else:
-            mv_datetime(**vars(args))
-    return 0
+    # Same --datetime for all files. A wrong one is an error, rather than silently using Recorded Date.
+    if args.datetime_opt and get_datetime_fromstr(args.datetime_opt) is None:
+        print(f'Wrong --datetime "{args.datetime_opt}". Use "yyyy-mm-dd[ HH:MM[:SS]]".', file=sys.stderr)
+        return 1
+
+    def process(path: str):
+        # One exiftool process (stay_open) per worker serves all its files.
+        etool = etools.get()
+        try:
+            if args.guess:
+                dif = guess_offset(path, etool)
+                print(f'{dif} : {path}')
+            elif args.touch:
+                return touch_datetime(**(vars(args) | {'path': path, 'etool': etool}))
+            else:
+                return mv_datetime(**(vars(args) | {'path': path, 'etool': etool}))
+        except Exception as e:
+            # Such as unreadable file. Fail this file only.
+            print(f'{path}: {e}', file=sys.stderr)
+            return 1
+
+    # Files are independent. Most of time is waiting mediainfo/exiftool, threads suffice.
+    # --simulate and --guess print per file. One worker keeps them in input order.
+    workers = 1 if args.simulate or args.guess else max(1, min(args.jobs, len(args.infiles)))
+    with ExifToolPerThread() as etools, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process, args.infiles))
+    # Nonzero if any file failed, others are still processed.
+    return 1 if any(results) else 0
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -44,6 +44,9 @@ Applying filters and encoders:
 `--encode` specifies the output encoder. It should be supplied only once.
   * Argument needs to be quoted to avoid shell unwantedly expands it.
   * Argument must start with a space to avoid `-c:v` or `-c:a` confused from `-c`.
+  * A value with spaces can be quoted inside, like " -metadata:g 'title=My trip'".
+    `-metadata` alone is taken for creation_time. Use `-metadata:g` for others.
+  * A video encoder given here (`-c:v` etc.) wins over `--hwenc`.
 
 Examples:
   -vf yadif=mode=send_frame : deinterlace by yadif filter,  
@@ -57,14 +60,34 @@ import argparse
 import sys
 import os
 import tempfile
+import shutil
+import functools
+import subprocess
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import re
 import shlex
-import ffmpeg # Need ffmpeg-python (not other similar ones)
-from _util import get_mediainfo, copy_exifdata, append_exifcomment, get_datetime_fromstr, get_datetime_fromfile, guess_offset, datetime2strs
-from typing import Any, Container, Iterable, List, Dict, Optional, Union
+import calendar
+from _util import get_datetime_fromstr, has_mediainfo, get_mediainfo_many, copy_exifdata, get_datetime, guess_offset, datetime2strs, ExifToolPerThread
+from typing import Any, Callable, Container, Iterable, List, Dict, Optional, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    from exiftool import ExifToolHelper
 
 DEFAULT_FONTFILE = 'CRR55.TTF'
 DEFAULT_SEC = 7
+HW_ENCODERS = ['h264_videotoolbox', 'h264_nvenc', 'h264_qsv', 'h264_vaapi'] # In order of preference
+VAAPI_DEVICE = '/dev/dri/renderD128' # VAAPI needs frames uploaded to this device
+HWENC_BITRATE = '8M' # Hardware encoders default to low bitrate. Enough for SD.
+DV_NTSC_FRAME_SIZE = 120000 # bytes per frame of 525/60 DV25
+DV_NTSC_RATE = 30000 / 1001
+FILTER_SCRIPT_LEN = 65536 # Longer filter graph is given by -filter_complex_script, far below ARG_MAX
+STDERR_LINES = 200 # Lines of ffmpeg stderr shown when it fails
+# Temp output by mkstemp() is 0600. Give the output the mode of a usual new file.
+_umask = os.umask(0o022)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
 
 cwd = os.path.dirname(os.path.realpath(__file__))
 
@@ -73,24 +96,55 @@ font_path = os.path.join(cwd, 'font', DEFAULT_FONTFILE)
 ffmpeg_path = 'ffmpeg'
 
 
+@functools.lru_cache(maxsize=None)
+def detect_hwenc(ffmpeg_cmd: str) -> str|None:
+    '''
+    Find the first hardware H.264 encoder that ffmpeg has and that actually works.
+    Listed encoders can fail without the device, so each one is tried with a tiny encode.
+    '''
+    try:
+        p = subprocess.run([ffmpeg_cmd, '-hide_banner', '-encoders'], text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    listed = {line.split()[1] for line in p.stdout.splitlines() if len(line.split()) > 1}
+    for encoder in HW_ENCODERS:
+        if encoder not in listed:
+            continue
+        vaapi = ['-vaapi_device', VAAPI_DEVICE, '-vf', 'format=nv12,hwupload'] if encoder == 'h264_vaapi' else []
+        p = subprocess.run([ffmpeg_cmd, '-hide_banner', '-v', 'error', '-f', 'lavfi', '-i', 'color=s=256x256',
+                            '-frames:v', '1', *vaapi, '-c:v', encoder, '-f', 'null', '-'],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if p.returncode == 0:
+            return encoder
+    return None
+
+
 def parse_string_to_dict(input_string: str) -> Dict[str, Union[str,bool]]:
-    # Split the input string by whitespace
-    pairs = input_string.split()
+    # Same strings come for every file. Parsed once, a new dict each call for callers to modify.
+    return dict(_parse_string_to_items(input_string))
 
-    # Initialize an empty dictionary
+
+@functools.lru_cache(maxsize=32)
+def _parse_string_to_items(input_string: str) -> tuple[tuple[str, Union[str,bool]], ...]:
+    # Split like shell, so that a quoted value can have spaces.
+    # Ex: ' -c:v libx264 -metadata "title=A B" -an' => {'c:v': 'libx264', 'metadata': 'title=A B', 'an': True}
     parsed_dict = {}
+    key = None
+    for token in shlex.split(input_string):
+        if token.startswith('-'):
+            if key is not None:
+                parsed_dict[key] = True # Previous key has no value
+            key = token[1:]  # Remove the leading '-'
+        elif key is not None:
+            parsed_dict[key] = token
+            key = None
+    if key is not None:
+        parsed_dict[key] = True
+
+    return tuple(parsed_dict.items())
 
-    # Iterate over the pairs and split them into key-value pairs
-    for i, pair in enumerate(pairs):
-        if pair.startswith('-'):
-            key = pair[1:]  # Remove the leading '-'
-            if i + 1 < len(pairs) and not pairs[i + 1].startswith('-'):
-                value = pairs[i + 1]
-            else:
-                value = True
-            parsed_dict[key] = value
 
-    return parsed_dict
+_FILTER_PARAM_RE = re.compile(r'\s*(?P<key>[^=:\s]+)\s*(?:=\s*(?P<value>[^:]*?)\s*)?(?::|$)')
 
 
 def parse_filter_args_to_dict(input_string: str) -> Dict[str, Union[str,bool]]:
@@ -100,20 +154,108 @@ def parse_filter_args_to_dict(input_string: str) -> Dict[str, Union[str,bool]]:
     Ex: 'crop=w=iw/2: exact' => {'name': 'crop', 'w': 'iw/2', 'exact': True}
     ffmpeg filters accepts omitting parameter names e.g. 'scale=iw/2:ih/2' but here you cannot.
     '''
-    parts = input_string.split('=', 1)
-    filter_name= parts[0].strip()
-    dictionary = {'name': filter_name}
-    if len(parts) == 2:
-        pairs = parts[1].split(':')
-        for pair in pairs:
-            pair = pair.strip()  # Remove leading and trailing spaces
-            if '=' in pair:
-                key, value = pair.split('=')
-                key, value = key.strip(), value.strip()
-            else:
-                key, value = pair.strip(), True
-            dictionary[key] = value
-    return dictionary
+    return dict(_parse_filter_args_to_items(input_string))
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_filter_args_to_items(input_string: str) -> tuple[tuple[str, Union[str,bool]], ...]:
+    filter_name, _, params = input_string.partition('=')
+    dictionary = {'name': filter_name.strip()}
+    # key[=value] pairs separated by ':', spaces around them removed.
+    for m in _FILTER_PARAM_RE.finditer(params):
+        key, value = m.group('key', 'value')
+        dictionary[key] = True if value is None else value
+    return tuple(dictionary.items())
+
+
+def resolve_output(input: str, output: str, optext: Optional[str|None] = None, output_is_dir: Optional[bool] = None) -> str:
+    '''
+    Output file path for input.
+    If output is a dir, put output there with the same name as input. optext replaces the extension.
+    Give output_is_dir if already known, not to stat output for each input.
+    '''
+    if output_is_dir is None:
+        output_is_dir = os.path.isdir(output)
+    if output_is_dir:
+        output = os.path.join(output, os.path.basename(input))
+    if optext is not None:
+        if not optext.startswith('.'):
+            optext = '.' + optext
+        output = os.path.splitext(output)[0] + optext
+    return output
+
+
+def popen_ffmpeg(args: List[str], stdin: Any = subprocess.DEVNULL, stdout: Any = subprocess.DEVNULL,
+                 stderr: Optional[int] = subprocess.PIPE) -> subprocess.Popen:
+    '''
+    Start ffmpeg of args with stderr piped, or None to the terminal. No stdin by default, parallel ffmpegs must not read the terminal.
+    Pipes made by Python are not inheritable, so close_fds=False is safe and lets Popen fork cheaply.
+    '''
+    return subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=stderr, close_fds=False)
+
+
+def drain_stderr(process: subprocess.Popen) -> Callable[[], bytes]:
+    '''
+    Keep the last STDERR_LINES lines of piped stderr of process by a thread.
+    Run ffmpeg with -nostats, its progress is not split into lines.
+    Returns a function to wait for its end and get them.
+    '''
+    if process.stderr is None:
+        return lambda: b''
+    tail = collections.deque(maxlen=STDERR_LINES)
+    drain = threading.Thread(target=tail.extend, args=(process.stderr,), daemon=True)
+    drain.start()
+    def join() -> bytes:
+        drain.join()
+        return b''.join(tail)
+    return join
+
+
+def clock_text(epoch: float, format: str) -> str:
+    '''
+    drawtext text of a clock running from epoch (seconds) by frame pts, in strftime format.
+    Escape ':' in format as '\\:'.
+    '''
+    return f'%{{pts:gmtime:{epoch:.3f}:{format}}}'
+
+
+def dv_window(input: str,
+              sec_begin: float,
+              sec_len: float) -> tuple[int, int]|None:
+    '''
+    Frames [begin, end) of the NTSC DV file input that rendering period covers,
+    or None if input is not a plain 525/60 DV25 stream with 48kHz audio.
+    Raw DV has fixed size frames, so frames out of the period can be copied as is.
+    '''
+    mediainfo = get_mediainfo_many(input, ['General;%Format%', 'Video;%Height%', 'Video;%FrameCount%', 'Audio;%SamplingRate%'])
+    if mediainfo['General;%Format%'] != 'DV' or mediainfo['Video;%Height%'] != '480' or mediainfo['Audio;%SamplingRate%'] != '48000':
+        return None
+    try:
+        frame_count = int(mediainfo['Video;%FrameCount%'])
+    except ValueError:
+        return None
+    if frame_count * DV_NTSC_FRAME_SIZE != os.path.getsize(input):
+        return None
+    begin = min(round(sec_begin * DV_NTSC_RATE), frame_count)
+    end = min(begin + round(sec_len * DV_NTSC_RATE), frame_count)
+    if begin == end:
+        return None
+    return begin, end
+
+
+def copy_bytes(fin, fout, size: int|None = None):
+    '''
+    Copy size bytes (till EOF if None) from fin to fout.
+    '''
+    if size is None:
+        shutil.copyfileobj(fin, fout)
+        return
+    while size > 0:
+        buf = fin.read(min(size, 1024 * 1024))
+        if not buf:
+            break
+        fout.write(buf)
+        size -= len(buf)
 
 
 def render_datetime(input: str,
@@ -130,158 +272,303 @@ def render_datetime(input: str,
                     args_vfilter: Optional[List[str]] = [],
                     args_afilter: Optional[List[str]] = [],
                     args_encode: Optional[str] = '',
+                    hwenc: Optional[bool] = False,
+                    copy: Optional[bool] = True,
                     text_size: Optional[int] = 5,
                     text_color: Optional[str] = 'white',
                     text_vpos: Optional[str] = 'b',
                     yes: Optional[bool] = False,
                     bug: Optional[bool] = False,
                     simulate: Optional[bool] = False,
+                    verbose: Optional[bool] = False,
+                    jobs: Optional[int] = 1,
                     arg0: Optional[str] = '',
+                    etool: Optional['ExifToolHelper'] = None,
+                    output_is_dir: Optional[bool] = None,
                     **kwargs: Any):
     '''
     Render date/time to a movie file.
     Internally uses ffmpeg and mediainfo
     '''
+    import ffmpeg # Need ffmpeg-python (not other similar ones). Imported here not to slow down --help etc.
     global ffmpeg_path
     global font_path
 
     # 1) Prepare output file
-    #    If it's a dir, put output there with the same name as input
-    reel_name = os.path.basename(input)
-    if os.path.isdir(output):
-        output = os.path.join(output, reel_name)
-    if input == output:
+    output = resolve_output(input, output, optext, output_is_dir)
+    root, fileext = os.path.splitext(output)
+    # Same file by another path or symlink is also caught. samefile() needs both to exist.
+    if input == output or (os.path.exists(input) and os.path.exists(output) and os.path.samefile(input, output)):
         print(f'Output will overwrite input {input}. Stop this.')
         return 1
-
-    # 2) Get information of the input movie
-    # General / Recorded date appears like 2005-07-02 09:48:06 in localtime
-    dt = get_datetime_fromstr(datetime_opt)
-    if dt is None:
-        dt = get_datetime_fromfile(input, offset)
-    if dt is None:
-        print(f'Fail to get recorded date from {input} and you did not provide datetime as option.', file=sys.stderr)
+    if not simulate and os.path.exists(output) and not yes:
+        print(f'{output} exists. Use -y to overwrite.', file=sys.stderr)
         return 1
-    if guess:
-        dif = guess_offset(input)
-        dt += dif
-    y0, m0, d0, hh0, mm0, ss0 = datetime2strs(dt)
-
-    # Prepare date / time values for drawtext
-    # 1) enable to limit rendering period
-    kwargs_enable = {}
-    if sec_begin < 0:
-        sec_begin = 0
-    if sec_len < 0:
-        kwargs_enable = {'enable': f'gte(t,{sec_begin})'}
-    else:
-        kwargs_enable = {'enable': f'between(t,{sec_begin},{sec_begin + sec_len})'}
-
-    # Font size / position
-    height = int(get_mediainfo(input, 'Video;%Height%'))
-    text_size = height * text_size / 100
-    if text_vpos == 't':
-        ypos = '2*lh'
-    else:
-        ypos = 'h-(2*lh)'
-    kwargs_enable |= {'fontfile': font_path, 'fontsize': text_size, 'fontcolor': text_color, 'borderw': 2} 
-
-    # 2) Text for drawtext
-    # Need clock advanced by sec_begin.
-    y1, m1, d1, hh1, mm1, ss1 = datetime2strs(dt + timedelta(seconds = sec_begin))
-    kwargs_date = {'text': f'{y1}-{m1}-{d1}' if show_date else ''} | kwargs_enable
-    kwargs_time = {'text': f'{hh1}:{mm1}' if show_time else ''} | kwargs_enable
-    if show_time and show_tc:
-        rate = float(get_mediainfo(input, 'General;%FrameRate%'))
-        kwargs_time |= {'timecode': f'{hh0}:{mm0}:{ss0};00', 'rate': rate, 'tc24hmax': True, 'text': ''}
-
-    # 3) Filters if optionally specified
-    # --> move to the ffmpeg parser
-
-    # 4) Special workaround for DV
-    # ffmpeg creation_time convert time to UTC. This is fine, but But Sony DV format seems assuming localtime.
-    # Need 'Z' to prevent ffmpeg converting local timezone to UTC.
-    # cf: https://video.stackexchange.com/questions/25568/what-is-the-correct-format-of-media-creation-time
-    # Saving DV requires target. We assume here NTSC.
-    datetime_s = f'{y0}-{m0}-{d0} {hh0}:{mm0}:{ss0}'
-    root, fileext = os.path.splitext(output)
 
-    if optext is not None:
-        if not optext.startswith('.'):
-            optext = '.' + optext
-        output = root + optext
-        fileext = optext
-
-    kwargs_output = parse_string_to_dict(args_encode)
-    if fileext == '.dv':
-        kwargs_output |= {'metadata': f'creation_time={datetime_s}Z', 'target': 'ntsc-dv'}
-    else:
-        kwargs_output |= {'metadata': f'creation_time={datetime_s}'}
-    
-    # 5) Render output movie
-    #    Do it async
-    in_mov = ffmpeg.input(input)
-    video = in_mov.video
-    audio = in_mov['a:0'] # Need to drop two or more audio streams if exist.
-
-    # 6) ffmpeg bug workaround.
-    # ffmpeg dv muxer sporadically fails around audio.
-    # As workaround, first write it in tmp file as wav.
-    # Then read it. Theoretically lossless.
-    tmp_wav = None
-    if bug:
-        #arate = get_mediainfo(input, 'Audio;%SamplingRate% ') # a space to split...
-        #arate = arate.split(' ')[0]
-        arate = 48000 # Resample outside the dv muxer seems necessary since ffmpeg 7.
-        temp_file = tempfile.mkstemp(suffix='.wav')
-        os.close(temp_file[0]) # We don't write from python.
-        tmp_wav = temp_file[1]
-        _, stderr = (
-            ffmpeg
-            .output(audio, tmp_wav, **{'f': 's16le', 'ar': arate, 'ac': 2})
-            .run(cmd=ffmpeg_path, quiet=True, overwrite_output=yes, capture_stderr=True)
-        )
-        #audio = ffmpeg.input(tmp_wav, **{'f': 's16le', 'ar': arate, 'ac': 2}).audio # setting -ar here fails. why?
-        audio = ffmpeg.input(tmp_wav, **{'f': 's16le', 'ac': 2}).audio
-
-    # 7) Build filter chain.
-    for argstr in args_vfilter:
-        # Apply filters before drawtext
-        # ffmpeg.filter() requires a filter name is explicitly given.
-        # kwargs_filter = parse_string_to_dict(argstr)
-        kwargs_filter = parse_filter_args_to_dict(argstr)
-        filter_name = kwargs_filter.pop('name', None)
-        if filter_name is not None:
-            video = ffmpeg.filter(video, filter_name, **kwargs_filter)
-    if show_date:
-        video = ffmpeg.drawtext(video, x='w*0.02', y=ypos, **kwargs_date)
-    if show_time:
-        video = ffmpeg.drawtext(video, x='(w-tw)-(w*0.02)', y=ypos, **kwargs_time)
-    for argstr in args_afilter:
-        kwargs_filter = parse_filter_args_to_dict(argstr)
-        filter_name = kwargs_filter.pop('name', None)
-        if filter_name is not None:
-            audio = ffmpeg.filter(audio, filter_name, **kwargs_filter)
-    result_stream = ffmpeg.output(video, audio, output, **kwargs_output)
-
-    # 8) Do it or simulate it.
-    retval = 0
-    if simulate:
-        args = ffmpeg.compile(result_stream, cmd=ffmpeg_path, overwrite_output=yes)
-        print(f'{shlex.join(args)}')
-    else:
-        process = ffmpeg.run_async(result_stream, cmd=ffmpeg_path, quiet=True, overwrite_output=yes, pipe_stderr=True)
-        _, stderr = process.communicate()
-        if process.returncode == 0:
-            if fileext != '.dv':
-                copy_exifdata(input, output)
-                append_exifcomment(output, f'{datetime.now().isoformat(timespec="seconds")} : {arg0} ')
+    # Temp files and the --bug ffmpeg are cleaned up however this ends.
+    tmp_files = []
+    wav_process = None
+    try:
+        # ffmpeg bug workaround (6) is started here, to extract audio while mediainfo probes the input.
+        # ffmpeg dv muxer sporadically fails around audio.
+        # As workaround, first extract it as raw s16le by another ffmpeg.
+        # Then read it from the pipe. Theoretically lossless, and nothing written to disk.
+        # The pipe blocks it until the main ffmpeg reads.
+        wav_args = None
+        if bug:
+            #arate = get_mediainfo(input, 'Audio;%SamplingRate% ') # a space to split...
+            #arate = arate.split(' ')[0]
+            arate = 48000 # Resample outside the dv muxer seems necessary since ffmpeg 7.
+            wav_stream = ffmpeg.input(input)['a:0'].output('pipe:', **{'f': 's16le', 'ar': arate, 'ac': 2})
+            if not verbose:
+                wav_stream = wav_stream.global_args('-nostats')
+            wav_args = ffmpeg.compile(wav_stream, cmd=ffmpeg_path)
+            if not simulate:
+                wav_process = popen_ffmpeg(wav_args, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.PIPE)
+                wav_stderr = drain_stderr(wav_process)
+
+        # 2) Get information of the input movie
+        # General / Recorded date appears like 2005-07-02 09:48:06 in localtime
+        # mediainfo runs once when a field is first asked, all fields are cached from it.
+        # With --datetime and nothing else to know, it does not run at all.
+        dt = get_datetime(input, datetime_opt, offset, etool)
+        if dt is None:
+            print(f'Fail to get recorded date from {input} and you did not provide datetime as option.', file=sys.stderr)
+            return 1
+        if guess:
+            dif = guess_offset(input, etool)
+            dt += dif
+        y0, m0, d0, hh0, mm0, ss0 = datetime2strs(dt)
+
+        # Prepare date / time values for drawtext
+        # 1) enable to limit rendering period
+        kwargs_enable = {}
+        if sec_begin < 0:
+            sec_begin = 0
+        if sec_len < 0:
+            kwargs_enable = {'enable': f'gte(t,{sec_begin})'}
+        else:
+            kwargs_enable = {'enable': f'between(t,{sec_begin},{sec_begin + sec_len})'}
+
+        # Font size / position
+        # Size relative to the frame height, evaluated by drawtext. No need to know the height here.
+        fontsize = f'h*{text_size / 100}'
+        if text_vpos == 't':
+            ypos = '2*lh'
+        else:
+            ypos = 'h-(2*lh)'
+        kwargs_enable |= {'fontfile': font_path, 'fontsize': fontsize, 'fontcolor': text_color, 'borderw': 2} 
+
+        # 2) Text for drawtext
+        # drawtext runs the clock from the recording time, so it shows dt + sec_begin at sec_begin and keeps going.
+        # The text is given to drawtext unescaped (escape_text=False) to expand %{pts}.
+        # dt is local time. Formatted as is by gmtime of its seconds as if in UTC.
+        epoch = calendar.timegm(dt.timetuple())
+        kwargs_date = kwargs_enable.copy()
+        kwargs_date['text'] = clock_text(epoch, '%Y-%m-%d') if show_date else ''
+        kwargs_time = kwargs_enable.copy()
+        kwargs_time['text'] = clock_text(epoch, '%H\\:%M') if show_time else ''
+        if show_time and show_tc:
+            rate = float(get_mediainfo_many(input, ['General;%FrameRate%'])['General;%FrameRate%'])
+            kwargs_time |= {'timecode': f'{hh0}:{mm0}:{ss0};00', 'rate': rate, 'tc24hmax': True, 'text': ''}
+
+        # 3) Filters if optionally specified
+        # --> move to the ffmpeg parser
+
+        # 4) Special workaround for DV
+        # ffmpeg creation_time convert time to UTC. This is fine, but But Sony DV format seems assuming localtime.
+        # Need 'Z' to prevent ffmpeg converting local timezone to UTC.
+        # cf: https://video.stackexchange.com/questions/25568/what-is-the-correct-format-of-media-creation-time
+        # Saving DV requires target. We assume here NTSC.
+        datetime_s = f'{y0}-{m0}-{d0} {hh0}:{mm0}:{ss0}'
+
+        # Nothing to render and the same container: copy streams and set creation_time only.
+        stream_copy = (not show_date and not show_time and os.path.splitext(input)[1].lower() == fileext.lower()
+                       and not (args_vfilter or args_afilter or args_encode or bug))
+        kwargs_output = parse_string_to_dict(args_encode) if args_encode else {}
+        vaapi = False
+        # ffmpegs run in parallel share CPUs, unless -threads is given.
+        if jobs > 1 and not stream_copy:
+            kwargs_output.setdefault('threads', max(1, (os.cpu_count() or 1) // jobs))
+        if stream_copy:
+            kwargs_output |= {'c': 'copy', 'metadata': f'creation_time={datetime_s}' + ('Z' if fileext == '.dv' else '')}
+        elif fileext == '.dv':
+            kwargs_output |= {'metadata': f'creation_time={datetime_s}Z', 'target': 'ntsc-dv'}
+        else:
+            kwargs_output |= {'metadata': f'creation_time={datetime_s}'}
+            # Hardware encoder unless video encoder is given by --encode
+            if hwenc and not any(key in kwargs_output for key in ('c', 'c:v', 'codec', 'codec:v', 'vcodec')):
+                encoder = detect_hwenc(ffmpeg_path)
+                if encoder is not None:
+                    kwargs_output['c:v'] = encoder
+                    vaapi = encoder == 'h264_vaapi'
+                    if not any(key in kwargs_output for key in ('b', 'b:v', 'q:v', 'qscale:v', 'crf', 'cq')):
+                        kwargs_output['b:v'] = HWENC_BITRATE
+
+        # DV to DV with nothing else to change: only frames in rendering period are encoded,
+        # others are copied as is. Date/time must be the embedded one as it remains in copied frames.
+        window = None
+        if (copy and not stream_copy and fileext == '.dv' and os.path.splitext(input)[1].lower() == '.dv' and sec_len >= 0 and not show_tc
+                and not (args_vfilter or args_afilter or args_encode or bug or guess or offset or datetime_opt)):
+            window = dv_window(input, sec_begin, sec_len)
+        # Write a temp file next to output and rename it on success,
+        # so that a failed or killed render never leaves a broken file by the output name.
+        # Unique by mkstemp, as files of the same name from other dirs may go to the same output dir.
+        if simulate:
+            tmp_out = output
+        else:
+            fd, tmp_out = tempfile.mkstemp(prefix=f'{os.path.basename(root)}.', suffix=f'.tmp{fileext}',
+                                           dir=os.path.dirname(output) or '.')
+            os.close(fd)
+            tmp_files.append(tmp_out)
+        movie_in, movie_out = input, tmp_out
+        # Full render uses them as is, also when the window cannot be spliced.
+        kwargs_full = (kwargs_date.copy(), kwargs_time.copy(), kwargs_output.copy())
+        if window is not None:
+            begin, end = window
+            # Rendered part is the period itself. Its recording time and clock start at frame begin.
+            kwargs_date.pop('enable')
+            kwargs_time.pop('enable')
+            if show_date:
+                kwargs_date['text'] = clock_text(epoch + begin / DV_NTSC_RATE, '%Y-%m-%d')
+            if show_time:
+                kwargs_time['text'] = clock_text(epoch + begin / DV_NTSC_RATE, '%H\\:%M')
+            y2, m2, d2, hh2, mm2, ss2 = datetime2strs(dt + timedelta(seconds = begin / DV_NTSC_RATE))
+            kwargs_output['metadata'] = f'creation_time={y2}-{m2}-{d2} {hh2}:{mm2}:{ss2}Z'
+            if simulate:
+                movie_in, movie_out = f'{root}.in{fileext}', f'{root}.out{fileext}'
+                print(f'# frames [{begin}, {end}) of {input} ==> {movie_in}')
+            else:
+                fd_in, movie_in = tempfile.mkstemp(suffix=fileext)
+                tmp_files.append(movie_in)
+                fd_out, movie_out = tempfile.mkstemp(suffix=fileext)
+                tmp_files.append(movie_out)
+                os.close(fd_out)
+                with open(input, 'rb') as fin, os.fdopen(fd_in, 'wb') as fout:
+                    fin.seek(begin * DV_NTSC_FRAME_SIZE)
+                    copy_bytes(fin, fout, (end - begin) * DV_NTSC_FRAME_SIZE)
+
+        # 5) Render output movie
+        def build(movie_in: str, movie_out: str, kwargs_date: Dict, kwargs_time: Dict, kwargs_output: Dict) -> List[str]:
+            '''
+            ffmpeg command to render movie_in to movie_out.
+            '''
+            in_mov = ffmpeg.input(movie_in)
+            video = in_mov.video
+            audio = in_mov['a:0'] # Need to drop two or more audio streams if exist.
+
+            # 6) ffmpeg bug workaround.
+            # Audio extraction was started at the beginning. Read it from stdin.
+            if bug:
+                #audio = ffmpeg.input('pipe:', **{'f': 's16le', 'ar': arate, 'ac': 2}).audio # setting -ar here fails. why?
+                audio = ffmpeg.input('pipe:', **{'f': 's16le', 'ac': 2}).audio
+
+            # 7) Build filter chain.
+            for argstr in args_vfilter:
+                # Apply filters before drawtext
+                # ffmpeg.filter() requires a filter name is explicitly given.
+                # kwargs_filter = parse_string_to_dict(argstr)
+                kwargs_filter = parse_filter_args_to_dict(argstr)
+                filter_name = kwargs_filter.pop('name', None)
+                if filter_name is not None:
+                    video = ffmpeg.filter(video, filter_name, **kwargs_filter)
+            if show_date:
+                video = ffmpeg.drawtext(video, x='w*0.02', y=ypos, escape_text=False, **kwargs_date)
+            if show_time:
+                video = ffmpeg.drawtext(video, x='(w-tw)-(w*0.02)', y=ypos, escape_text=False, **kwargs_time)
+            for argstr in args_afilter:
+                kwargs_filter = parse_filter_args_to_dict(argstr)
+                filter_name = kwargs_filter.pop('name', None)
+                if filter_name is not None:
+                    audio = ffmpeg.filter(audio, filter_name, **kwargs_filter)
+            if vaapi:
+                # Filters run on CPU, upload rendered frames to the device.
+                video = video.filter('format', 'nv12').filter('hwupload')
+            result_stream = ffmpeg.output(video, audio, movie_out, **kwargs_output)
+            if vaapi:
+                result_stream = result_stream.global_args('-vaapi_device', VAAPI_DEVICE)
+            if not verbose:
+                # Progress lines end by '\r', not '\n'. In a pipe they would make one ever growing line.
+                result_stream = result_stream.global_args('-nostats')
+            overwrite = yes or window is not None or not simulate # Temp files may already exist.
+            return ffmpeg.compile(result_stream, cmd=ffmpeg_path, overwrite_output=overwrite)
+
+        def run(args: List[str]) -> tuple[int, bytes]:
+            '''
+            Run ffmpeg of args. Returns its return code and the tail of stderr.
+            '''
+            graph_script = None
+            try:
+                # Many filters can make the graph too long for a command line. Give it by a file then.
+                if '-filter_complex' in args:
+                    i = args.index('-filter_complex')
+                    if len(args[i + 1]) > FILTER_SCRIPT_LEN:
+                        fd, graph_script = tempfile.mkstemp(suffix='.txt')
+                        with os.fdopen(fd, 'w') as f:
+                            f.write(args[i + 1])
+                        args[i:i + 2] = ['-filter_complex_script', graph_script]
+                # Keep only the tail of stderr. --verbose shows it as is.
+                if wav_process is not None:
+                    process = popen_ffmpeg(args, stdin=wav_process.stdout, stderr=None if verbose else subprocess.PIPE)
+                    wav_process.stdout.close() # Only ffmpeg reads it. It gets SIGPIPE if ffmpeg stops.
+                else:
+                    process = popen_ffmpeg(args, stderr=None if verbose else subprocess.PIPE)
+                process_stderr = drain_stderr(process)
+                retval = process.wait()
+                stderr = process_stderr()
+                if wav_process is not None:
+                    wav_process.wait()
+                    if retval == 0 and wav_process.returncode != 0:
+                        # Audio may be cut short. Don't take it.
+                        retval = wav_process.returncode
+                        stderr = wav_stderr()
+                return retval, stderr
+            finally:
+                if graph_script:
+                    os.remove(graph_script)
+
+        # 8) Do it or simulate it.
+        retval = 0
+        args = build(movie_in, movie_out, kwargs_date, kwargs_time, kwargs_output)
+        if simulate:
+            if wav_args is not None:
+                print(f'{shlex.join(wav_args)} | \\')
+            print(f'{shlex.join(args)}')
+            if window is not None:
+                print(f'# frames [0, {begin}) of {input} + {movie_out} + frames [{end}, ) of {input} ==> {output}')
         else:
-            print(f' -- stderr: {stderr.decode('utf-8')}', file=sys.stderr)
-        retval = process.returncode
-    if tmp_wav:
-        os.remove(tmp_wav)
-    return retval
+            retval, stderr = run(args)
+            if retval == 0 and window is not None:
+                # Raw DV can be simply concatenated, if ffmpeg neither dropped nor duplicated a frame.
+                size = os.path.getsize(movie_out)
+                if size == (end - begin) * DV_NTSC_FRAME_SIZE:
+                    with open(input, 'rb') as fin, open(movie_out, 'rb') as fwin, open(tmp_out, 'wb') as fout:
+                        copy_bytes(fin, fout, begin * DV_NTSC_FRAME_SIZE)
+                        copy_bytes(fwin, fout)
+                        fin.seek(end * DV_NTSC_FRAME_SIZE)
+                        copy_bytes(fin, fout)
+                else:
+                    # Such as the dv muxer dropped the last frame short of audio samples.
+                    print(f'Rendered period of {input} is {size / DV_NTSC_FRAME_SIZE:g} frames, not {end - begin}. Render all frames.', file=sys.stderr)
+                    retval, stderr = run(build(input, tmp_out, *kwargs_full))
+            if retval == 0:
+                os.chmod(tmp_out, FILE_MODE)
+                os.replace(tmp_out, output)
+                if fileext != '.dv':
+                    # One exiftool write for both copy and comment.
+                    copy_exifdata(input, output, etool, comment=f'{datetime.now().isoformat(timespec="seconds")} : {arg0} ')
+            elif stderr:
+                print(f' -- stderr: {stderr.decode("utf-8")}', file=sys.stderr)
+        return retval
+    finally:
+        if wav_process is not None:
+            if wav_process.poll() is None:
+                wav_process.kill()
+            wav_process.stdout.close()
+            wav_process.wait()
+        for path in tmp_files:
+            if os.path.exists(path):
+                os.remove(path) # Left by failed ffmpeg, or the window
 
 
 def main(argv: Optional[List[str]] = None) -> int:
@@ -313,10 +600,14 @@ def main(argv: Optional[List[str]] = None) -> int:
     parser.add_argument('--vf', '-vf', dest='args_vfilter', metavar='args', action='append', default=[], help='Video filter. Ex "scale=w=iw/2:h=ih/2"')
     parser.add_argument('--af', '-af', dest='args_afilter', metavar='args', action='append', default=[], help='Audio filter. Ex "afftdn=nr=10:nf=-40"')
     parser.add_argument('--encode', dest='args_encode', metavar='args', default='', help='Encode arguments. Ex " -c:v libx264 -preset slow -c:a ac3"')
+    parser.add_argument('--hwenc', action=argparse.BooleanOptionalAction, default=False, help='Use hardware H.264 encoder if available, except for .dv')
+    parser.add_argument('--copy', action=argparse.BooleanOptionalAction, default=True, help='DV to DV, copy frames out of rendering period as is if possible')
     parser.add_argument('-y', '--yes', action='store_true', default=False, help='Yes to overwrite')
     parser.add_argument('--ffmpeg', metavar='path', default=None, help='Full path to ffmpeg')
     parser.add_argument('--bug', action='store_true', default=False, help='Bug workaround. Try it when "Assertion cur_size >= size"')
     parser.add_argument('--simulate', action='store_true', default=False, help='Print generated ffmpeg command, no execution')
+    parser.add_argument('--verbose', action='store_true', default=False, help='Show ffmpeg output and progress as is')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=max(1, (os.cpu_count() or 1) // 2), help='Number of files rendered in parallel')
     parser.add_argument('-e', '--ext', dest='optext', metavar='ext', default=None, help='File extension for output (dv, mov, mp4 etc)')
     parser.add_argument('infiles', nargs='+', type=str, help='Input movie files')
     parser.add_argument('output', help='Output dir or file')
@@ -328,10 +619,52 @@ def main(argv: Optional[List[str]] = None) -> int:
         font_path = args.font
     if args.ffmpeg is not None:
         ffmpeg_path = args.ffmpeg
-    for path in args.infiles:
-        args.input = path
-        render_datetime(**vars(args))
-    return 0
+    # Fail once here rather than per file. shutil.which() spawns nothing.
+    if not has_mediainfo():
+        print('mediainfo not found.', file=sys.stderr)
+        return 1
+    if not args.simulate and shutil.which(ffmpeg_path) is None:
+        print(f'{ffmpeg_path} not found.', file=sys.stderr)
+        return 1
+    # Parse --encode here once. Workers get it from the cache.
+    try:
+        parse_string_to_dict(args.args_encode)
+    except ValueError as e:
+        print(f'Wrong --encode "{args.args_encode}": {e}.', file=sys.stderr)
+        return 1
+    # A missing font fails ffmpeg only after decoding starts. Check it once if drawtext uses it.
+    if (args.show_date or args.show_time) and not os.path.isfile(font_path):
+        print(f'Font file {font_path} not found. Use --font.', file=sys.stderr)
+        return 1
+    # Same --datetime for all files. A wrong one is an error, rather than silently using Recorded Date.
+    if args.datetime_opt and get_datetime_fromstr(args.datetime_opt) is None:
+        print(f'Wrong --datetime "{args.datetime_opt}". Use "yyyy-mm-dd[ HH:MM[:SS]]".', file=sys.stderr)
+        return 1
+    # ffmpeg-python sorts the graph recursively, one level per filter node. Allow long --vf/--af chains.
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 1000 + 4 * (len(args.args_vfilter) + len(args.args_afilter))))
+    # Each file is rendered by its own ffmpeg process, threads suffice to run them in parallel.
+    # ffmpeg is multi-threaded by itself, so default jobs is half of the CPUs.
+    # Same output for all files, stat it once.
+    args.output_is_dir = os.path.isdir(args.output)
+    # No more workers than files, so that a single file gets all CPUs by ffmpeg -threads.
+    args.jobs = max(1, min(args.jobs, len(args.infiles)))
+    # --simulate prints a few lines per file. One worker keeps them together and in input order.
+    # args.jobs is kept, so the printed -threads is the same as a real run.
+    workers = 1 if args.simulate else args.jobs
+
+    def process(path: str):
+        # One exiftool process (stay_open) per worker serves all its files.
+        try:
+            return render_datetime(**(vars(args) | {'input': path, 'etool': etools.get()}))
+        except Exception as e:
+            # Such as unreadable input. Fail this file only.
+            print(f'{path}: {e}', file=sys.stderr)
+            return 1
+
+    with ExifToolPerThread() as etools, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process, args.infiles))
+    # Nonzero if any file failed, others are still processed.
+    return 1 if any(results) else 0
 
 if __name__ == '__main__':
     sys.exit(main())